@@ -6,16 +6,12 @@ Main CLI entry point
 """
 
 import argparse
-import ast
-import json
 import os
 import sys
 from pathlib import Path
-import copy
 
 from src.logger import Logger, LogLevel
 from src.config import Config, Presets
-from src.pipeline import Pipeline
 
 
 def file_exists(filepath):
@@ -31,6 +27,9 @@ def read_file(filepath):
 
 def load_config_file(filepath, logger):
     """Load a config file (JSON or Python literal)"""
+    import ast
+    import json
+    
     content = read_file(filepath)
     try:
         data = json.loads(content)
@@ -38,19 +37,13 @@ def load_config_file(filepath, logger):
         try:
             data = ast.literal_eval(content)
         except Exception as exc:  # pylint: disable=broad-except
-            logger.error(f'Failed to parse config file: {exc}')
+            logger.error('Failed to parse config file: %s', exc)
             raise
     if not isinstance(data, dict):
         logger.error('Config file must define a dictionary with pipeline options')
     return data
 
 
-def write_file(filepath, content):
-    """Write content to file"""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-
 def main():
     """Main CLI function"""
     parser = argparse.ArgumentParser(
@@ -113,31 +106,31 @@ def main():
     
     # Check input file exists
     if not file_exists(args.input):
-        logger.error(f'The file "{args.input}" was not found!')
+        logger.error('The file "%s" was not found!', args.input)
         sys.exit(1)
     
     # Determine config
-    base_config = Presets.get(args.preset)
+    base_config = Presets.get_mutable(args.preset)
     config = None
     if args.config:
         if not file_exists(args.config):
-            logger.error(f'The config file "{args.config}" was not found!')
+            logger.error('The config file "%s" was not found!', args.config)
             sys.exit(1)
         try:
             custom_config = load_config_file(args.config, logger)
         except Exception:
             sys.exit(1)
         if base_config:
-            config = copy.deepcopy(base_config)
+            config = base_config
             config.update(custom_config)
         else:
             config = custom_config
     else:
-        config = copy.deepcopy(base_config) if base_config else {}
+        config = base_config if base_config else {}
     
     if not config:
         logger.warn('No config specified, falling back to Minify preset')
-        config = copy.deepcopy(Presets.get('Minify'))
+        config = Presets.get_mutable('Minify')
     
     # Override Lua version
     if args.Lua51:
@@ -161,21 +154,35 @@ def main():
     try:
         source = read_file(args.input)
     except Exception as e:
-        logger.error(f'Failed to read input file: {e}')
+        logger.error('Failed to read input file: %s', e)
         sys.exit(1)
     
-    # Create and run pipeline
+    # Create and run pipeline, streaming the output file
     try:
+        # Imported lazily so --help and argument errors stay fast
+        from src.pipeline import Pipeline
+        
         pipeline = Pipeline.from_config(config, logger)
-        output = pipeline.apply(source, args.input)
         
-        # Write output
-        logger.info(f'Writing output to "{out_file}"')
-        write_file(out_file, output)
+        # Stream into a temporary file next to the output and only replace
+        # the output once obfuscation succeeded, so failures leave it intact
+        tmp_file = f'{out_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_file, 'x', encoding='utf-8', buffering=1 << 20) as out:
+                pipeline.apply(source, args.input, out)
+            if file_exists(out_file):
+                import shutil
+                shutil.copymode(out_file, tmp_file)
+            logger.info('Writing output to "%s"', out_file)
+            os.replace(tmp_file, out_file)
+        except BaseException:
+            if file_exists(tmp_file):
+                os.unlink(tmp_file)
+            raise
         logger.info('Done!')
         
     except Exception as e:
-        logger.error(f'Obfuscation failed: {e}')
+        logger.error('Obfuscation failed: %s', e)
         import traceback
         traceback.print_exc()
         sys.exit(1)
@@ -3,6 +3,30 @@ Prometheus Configuration
 Configuration objects and presets for obfuscation
 """
 
+from types import MappingProxyType
+
+
+def _freeze(preset):
+    """Wrap a preset and its steps in read-only views"""
+    frozen = dict(preset)
+    frozen['Steps'] = tuple(
+        MappingProxyType({'Name': step['Name'], 'Settings': MappingProxyType(dict(step['Settings']))})
+        for step in preset['Steps']
+    )
+    return MappingProxyType(frozen)
+
+
+def _clone(preset):
+    """Copy a preset into plain, mutable dicts and lists"""
+    # Presets only nest one level (steps -> flat settings), so this is all
+    # copy.deepcopy would do, without its memo/reflection overhead
+    config = {key: value for key, value in preset.items() if key != 'Steps'}
+    config['Steps'] = [
+        {'Name': step['Name'], 'Settings': dict(step['Settings'])}
+        for step in preset['Steps']
+    ]
+    return config
+
 
 class Config:
     """Configuration constants"""
@@ -15,15 +39,16 @@ class Presets:
     """Obfuscation presets"""
     
     _presets = {
-        'Minify': {
+        'Minify': _freeze({
             'LuaVersion': 'LuaU',
             'VarNamePrefix': '',
             'NameGenerator': 'MangledShuffled',
             'PrettyPrint': False,
             'Seed': 0,
+            'RenameVariables': False,
             'Steps': []
-        },
-        'Weak': {
+        }),
+        'Weak': _freeze({
             'LuaVersion': 'LuaU',
             'VarNamePrefix': '',
             'NameGenerator': 'MangledShuffled',
@@ -42,8 +67,8 @@ class Presets:
                     }
                 }
             ]
-        },
-        'Medium': {
+        }),
+        'Medium': _freeze({
             'LuaVersion': 'LuaU',
             'VarNamePrefix': '',
             'NameGenerator': 'MangledShuffled',
@@ -70,8 +95,8 @@ class Presets:
                     'Settings': {}
                 }
             ]
-        },
-        'Strong': {
+        }),
+        'Strong': _freeze({
             'LuaVersion': 'LuaU',
             'VarNamePrefix': '',
             'NameGenerator': 'MangledShuffled',
@@ -106,14 +131,20 @@ class Presets:
                     'Settings': {}
                 }
             ]
-        }
+        })
     }
     
     @classmethod
     def get(cls, name):
-        """Get a preset by name"""
+        """Get a read-only preset by name"""
         return cls._presets.get(name)
     
+    @classmethod
+    def get_mutable(cls, name):
+        """Get a modifiable copy of a preset by name"""
+        preset = cls._presets.get(name)
+        return _clone(preset) if preset is not None else None
+    
     @classmethod
     def list(cls):
         """List all available presets"""
@@ -40,22 +40,30 @@ class Logger:
             return f"{color}{text}{Colors.RESET}"
         return text
     
-    def debug(self, message):
-        """Log debug message"""
+    def debug(self, message, *args):
+        """Log debug message, %-formatting args only if it is shown"""
         if self.log_level <= LogLevel.DEBUG:
-            print(self._color(f"[DEBUG] {message}", Colors.CYAN))
+            if args:
+                message = message % args
+            sys.stdout.write(self._color(f"[DEBUG] {message}", Colors.CYAN) + '\n')
     
-    def info(self, message):
-        """Log info message"""
+    def info(self, message, *args):
+        """Log info message, %-formatting args only if it is shown"""
         if self.log_level <= LogLevel.INFO:
-            print(self._color(f"[INFO] {message}", Colors.GREEN))
+            if args:
+                message = message % args
+            sys.stdout.write(self._color(f"[INFO] {message}", Colors.GREEN) + '\n')
     
-    def warn(self, message):
-        """Log warning message"""
+    def warn(self, message, *args):
+        """Log warning message, %-formatting args only if it is shown"""
         if self.log_level <= LogLevel.WARN:
-            print(self._color(f"[WARN] {message}", Colors.YELLOW))
+            if args:
+                message = message % args
+            sys.stdout.write(self._color(f"[WARN] {message}", Colors.YELLOW) + '\n')
     
-    def error(self, message):
+    def error(self, message, *args):
         """Log error message and exit"""
-        print(self._color(f"[ERROR] {message}", Colors.RED), file=sys.stderr)
+        if args:
+            message = message % args
+        sys.stderr.write(self._color(f"[ERROR] {message}", Colors.RED) + '\n')
         sys.exit(1)
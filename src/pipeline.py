@@ -9,9 +9,8 @@ from src.prometheus.tokenizer import Tokenizer
 from src.prometheus.parser import Parser
 from src.prometheus.unparser import Unparser
 from src.prometheus.namegen import create_generator
-from src.prometheus.renamer import VariableRenamer
+from src.prometheus.renamer import create_renamer
 from src.prometheus.context import PipelineContext
-from src.prometheus.steps import STEP_REGISTRY
 
 
 class Pipeline:
@@ -25,10 +24,13 @@ class Pipeline:
         self.pretty_print = config.get('PrettyPrint', False)
         self.var_name_prefix = config.get('VarNamePrefix', '')
         self.seed = config.get('Seed', 0)
+        self.rename = config.get('RenameVariables', True)
         self.steps = []
         
         # Initialize tokenizer, parser, and unparser
-        self.tokenizer = Tokenizer(self.lua_version)
+        # The pipeline never reads token positions: operator and symbol
+        # tokens are shared, and tokens built by steps carry none
+        self.tokenizer = Tokenizer(self.lua_version, track_positions=False)
         self.parser = Parser(self.lua_version)
         self.unparser = Unparser(self.lua_version, self.pretty_print)
     
@@ -39,6 +41,10 @@ class Pipeline:
         
         # Add steps from config
         steps = config.get('Steps', [])
+        if not steps:
+            return pipeline
+        
+        from src.prometheus.steps import STEP_REGISTRY
         for step_config in steps:
             step_name = step_config.get('Name')
             step_settings = step_config.get('Settings', {})
@@ -46,14 +52,18 @@ class Pipeline:
             if step_class:
                 pipeline.steps.append(step_class(step_settings))
             else:
-                logger.warn(f'Unknown step "{step_name}", skipping')
+                logger.warn('Unknown step "%s", skipping', step_name)
         
         return pipeline
     
-    def apply(self, code, filename='Anonymous Script'):
-        """Apply obfuscation pipeline to code"""
+    def apply(self, code, filename='Anonymous Script', out=None):
+        """Apply obfuscation pipeline to code
+        
+        If `out` is a writable text file, the generated code is streamed
+        into it and None is returned; otherwise the code is returned.
+        """
         start_time = time.time()
-        self.logger.info(f"Applying Obfuscation Pipeline to {filename} ...")
+        self.logger.info("Applying Obfuscation Pipeline to %s ...", filename)
         
         # Seed random generator
         seed = self.seed if self.seed > 0 else int(time.time())
@@ -70,7 +80,7 @@ class Pipeline:
         parse_start = time.time()
         ast = self.parser.parse(tokens)
         parse_time = time.time() - parse_start
-        self.logger.info(f"Parsing Done in {parse_time:.2f} seconds")
+        self.logger.info("Parsing Done in %.2f seconds", parse_time)
         
         # Create pipeline context
         context = PipelineContext(
@@ -86,22 +96,28 @@ class Pipeline:
         for step in self.steps:
             step_start = time.time()
             step_name = step.NAME
-            self.logger.info(f'Applying Step "{step_name}" ...')
+            self.logger.info('Applying Step "%s" ...', step_name)
             ast = step.apply(ast, context)
             step_time = time.time() - step_start
-            self.logger.info(f'Step "{step_name}" Done in {step_time:.2f} seconds')
+            self.logger.info('Step "%s" Done in %.2f seconds', step_name, step_time)
         
-        # Rename variables
-        self.rename_variables(ast, seed)
+        # Rename variables (presets such as Minify can opt out)
+        if self.rename:
+            self.rename_variables(ast, seed)
         
         # Unparse (generate code)
-        code = self.unparse(ast)
+        if out is None:
+            code = self.unparse(ast)
+            output_len = len(code)
+        else:
+            code = None
+            output_len = self.unparse_to(ast, out)
         
         total_time = time.time() - start_time
-        self.logger.info(f"Obfuscation Done in {total_time:.2f} seconds")
+        self.logger.info("Obfuscation Done in %.2f seconds", total_time)
         
-        size_percent = (len(code) / source_len) * 100
-        self.logger.info(f"Generated Code size is {size_percent:.2f}% of the Source Code size")
+        size_percent = (output_len / source_len) * 100
+        self.logger.info("Generated Code size is %.2f%% of the Source Code size", size_percent)
         
         return code
     
@@ -115,16 +131,22 @@ class Pipeline:
         generator = create_generator(
             generator_name,
             prefix=self.var_name_prefix,
-            reserved=set(self.tokenizer.keywords),
+            reserved=self.tokenizer.keywords,
             seed=seed
         )
         
         # Apply variable renaming
-        renamer = VariableRenamer(ast.tokens, generator, self.tokenizer.keywords)
+        renamer = create_renamer(
+            ast.token_list(),
+            generator,
+            self.tokenizer.keywords,
+            lua_version=self.lua_version,
+            has_steps=bool(self.steps)
+        )
         ast.tokens = renamer.rename()
         
         rename_time = time.time() - start_time
-        self.logger.info(f"Renaming Done in {rename_time:.2f} seconds")
+        self.logger.info("Renaming Done in %.2f seconds", rename_time)
     
     def unparse(self, ast):
         """Generate code from AST"""
@@ -134,6 +156,21 @@ class Pipeline:
         code = self.unparser.unparse(ast)
         
         unparse_time = time.time() - start_time
-        self.logger.info(f"Code Generation Done in {unparse_time:.2f} seconds")
+        self.logger.info("Code Generation Done in %.2f seconds", unparse_time)
         
         return code
+    
+    def unparse_to(self, ast, out):
+        """Stream generated code from AST into a file, returning its length"""
+        start_time = time.time()
+        self.logger.info("Generating Code ...")
+        
+        length = 0
+        for chunk in self.unparser.unparse_iter(ast):
+            out.write(chunk)
+            length += len(chunk)
+        
+        unparse_time = time.time() - start_time
+        self.logger.info("Code Generation Done in %.2f seconds", unparse_time)
+        
+        return length
@@ -1,6 +1,6 @@
 """Name generator utilities for Prometheus"""
 
-from typing import Iterator, List, Set
+from typing import AbstractSet, Iterator, List
 import random
 
 
@@ -9,40 +9,44 @@ class NameGenerator:
 
     DEFAULT_ALPHABET = list('lI1O0')
 
-    def __init__(self, prefix: str = '', reserved: Set[str] | None = None, seed: int | None = None):
-        self.prefix = prefix
-        self.reserved = set(reserved or [])
-        self.counter = 0
-        self.rng = random.Random(seed)
-        self.alphabet = self.DEFAULT_ALPHABET.copy()
+    def __init__(self, prefix: str = '', reserved: AbstractSet[str] | None = None, seed: int | None = None):
+        self.prefix: str = prefix
+        self.reserved: frozenset[str] = frozenset(reserved or ())
+        self.counter: int = 0
+        self.rng: random.Random = random.Random(seed)
+        self.alphabet: List[str] = self.DEFAULT_ALPHABET.copy()
         self.rng.shuffle(self.alphabet)
+        self._encoded: List[str] = []
 
     def next_name(self) -> str:
         """Generate the next obfuscated name"""
+        # _encode is a bijection over the counter, so issued names never
+        # repeat and only the reserved names need to be skipped
         while True:
-            name = self._encode(self.counter)
+            candidate = self.prefix + self._encode(self.counter)
             self.counter += 1
-            candidate = f"{self.prefix}{name}"
             if candidate not in self.reserved:
-                self.reserved.add(candidate)
                 return candidate
 
     def _encode(self, value: int) -> str:
-        base = len(self.alphabet)
+        encoded = self._encoded
+        if value < len(encoded):
+            return encoded[value]
+        alphabet = self.alphabet
+        base = len(alphabet)
         if base == 0:
             raise ValueError('Alphabet cannot be empty')
-        number = value
-        chars: List[str] = []
-        while True:
-            number, remainder = divmod(number, base)
-            chars.append(self.alphabet[remainder])
-            if number == 0:
-                break
-            number -= 1
-        return ''.join(chars)
+        # Bijective base-N: every name is its lowest digit followed by the
+        # (already cached) encoding of value // base - 1
+        for number in range(len(encoded), value + 1):
+            if number < base:
+                encoded.append(alphabet[number])
+            else:
+                encoded.append(alphabet[number % base] + encoded[number // base - 1])
+        return encoded[value]
 
 
-def create_generator(name: str, prefix: str = '', reserved: Set[str] | None = None, seed: int | None = None) -> NameGenerator:
+def create_generator(name: str, prefix: str = '', reserved: AbstractSet[str] | None = None, seed: int | None = None) -> NameGenerator:
     """Factory for name generators"""
     generator = NameGenerator(prefix=prefix, reserved=reserved, seed=seed)
     if name.lower() in ('mangled', 'mangledshuffled', 'mangled_shuffled'):
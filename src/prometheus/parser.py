@@ -4,14 +4,57 @@ Converts token streams into a simple AST structure
 """
 
 from dataclasses import dataclass
-from typing import List
+from itertools import chain
+from typing import Iterable, List, Tuple, Union
 from .tokenizer import Token
 
 
+class TokenRope:
+    """Token sequence stored as a list of segments
+
+    Steps splice helper code in front of or around the program by adding
+    segments, so none of them has to copy every token to do it.
+    """
+    __slots__ = ('segments',)
+    
+    def __init__(self, segments: Iterable[Union[List[Token], 'TokenRope']] = ()):
+        self.segments: List[List[Token]] = []
+        for segment in segments:
+            if isinstance(segment, TokenRope):
+                self.segments.extend(segment.segments)
+            elif segment:
+                self.segments.append(segment)
+    
+    def __iter__(self):
+        return chain.from_iterable(self.segments)
+    
+    def __len__(self):
+        return sum(map(len, self.segments))
+    
+    def split_eof(self) -> Tuple['TokenRope', Token]:
+        """Split off the trailing EOF token"""
+        last = self.segments[-1]
+        if len(last) == 1:
+            return TokenRope(self.segments[:-1]), last[0]
+        # Only the segment holding EOF is copied; steps keep EOF in a
+        # segment of its own, so this happens at most once per program
+        return TokenRope([*self.segments[:-1], last[:-1]]), last[-1]
+
+
 @dataclass
 class Module:
     """Simple AST representation holding tokens"""
-    tokens: List[Token]
+    tokens: Union[List[Token], TokenRope]
+    
+    def split_eof(self) -> Tuple[TokenRope, Token]:
+        """Split the tokens into the program body and the EOF token"""
+        return TokenRope([self.tokens]).split_eof()
+    
+    def token_list(self) -> List[Token]:
+        """Flatten the tokens into a single list, in place"""
+        if not isinstance(self.tokens, list):
+            self.tokens = list(self.tokens)
+        return self.tokens
 
 
 class Parser:
@@ -21,5 +64,9 @@ class Parser:
         self.lua_version = lua_version
     
     def parse(self, tokens: List[Token]) -> Module:
-        """Parse tokens into a Module"""
-        return Module(tokens=list(tokens))
+        """Parse tokens into a Module
+
+        A list is used as-is rather than copied, so the Module takes
+        ownership of it and the caller must not reuse it afterwards.
+        """
+        return Module(tokens=tokens if isinstance(tokens, list) else list(tokens))
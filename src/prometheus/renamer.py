@@ -2,54 +2,134 @@
 
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+from array import array
+from typing import AbstractSet, Callable, Dict, List, Optional
 
 from .tokenizer import Token, TokenType
 from .namegen import NameGenerator
 
+# Enum members are singletons, so the hot loops bind these and compare
+# with `is` instead of looking up TokenType attributes on every token
+_EOF = TokenType.EOF
+_KEYWORD = TokenType.KEYWORD
+_IDENTIFIER = TokenType.IDENTIFIER
+
+# Small-int kinds for the punctuation that matters inside type annotations,
+# and bitmasks over them so each token needs a single shift-and-test
+_ANNOTATION_KINDS = {',': 1, '=': 2, ')': 3, ';': 4, '<': 5, '(': 6, '[': 7, '>': 8, ']': 9}
+_ANNOTATION_END = (1 << 1) | (1 << 2) | (1 << 3) | (1 << 4)
+_ANNOTATION_OPEN = (1 << 5) | (1 << 6) | (1 << 7)
+_ANNOTATION_CLOSE = (1 << 8) | (1 << 3) | (1 << 9)
+_ANNOTATION_STOP = _ANNOTATION_END | _ANNOTATION_CLOSE
+
+# Block ids kept on the renamer's signed-byte block stack
+_FUNCTION_BLOCK = 1
+_FOR_BLOCK = 2
+_DO_BLOCK = 3
+_THEN_BLOCK = 4
+_ELSE_BLOCK = 5
+_ELSEIF_BLOCK = 6
+_REPEAT_BLOCK = 7
+
 
 class VariableRenamer:
     """Renames local variables while respecting Lua scoping rules"""
 
-    def __init__(self, tokens: List[Token], generator: NameGenerator, keywords: set[str]):
-        self.tokens = tokens
-        self.generator = generator
-        self.keywords = keywords
-        self.scope_stack: List[Dict[str, str]] = [dict()]
-        self.block_stack: List[str] = []
-        self.pending_for_scopes: List[bool] = []
+    # Whether `name: type` annotations must be skipped after declarations
+    TYPE_ANNOTATIONS = True
+
+    def __init__(self, tokens: List[Token], generator: NameGenerator, keywords: AbstractSet[str]):
+        self.tokens: List[Token] = tokens
+        # Parallel type/value arrays; renames are written to `values` and
+        # copied back onto the tokens once at the end of `rename`.
+        self.types: List[TokenType] = [token.type for token in tokens]
+        self.values: List[str] = [token.value for token in tokens]
+        # The renamer never inserts or removes tokens, so the length is fixed
+        self.length: int = len(tokens)
+        # Property accesses are fixed by punctuation, which is never renamed
+        self._property_mask: bytearray = self._compute_property_mask()
+        # Built on the first type annotation, most scripts never need it
+        self._annotation_kinds: Optional[bytes] = None
+        self.generator: NameGenerator = generator
+        self.keywords: AbstractSet[str] = keywords
+        # name -> stack of renames currently in effect (innermost last)
+        self.active: Dict[str, List[str]] = {}
+        # names declared in each open scope, used to unwind `active` on pop
+        self.scope_names: List[List[str]] = [[]]
+        # popped scope lists, reused by _push_scope
+        self._scope_pool: List[List[str]] = []
+        self.block_stack: array = array('b')
+        # `for` headers whose `do` must not open a second scope
+        self.pending_for_scopes: int = 0
+        self._kw_handlers: Dict[str, Callable[[int], int]] = {
+            'local': self._handle_local,
+            'function': self._handle_function,
+            'for': self._handle_for,
+            'do': self._handle_do,
+            'then': self._handle_then,
+            'else': self._handle_else,
+            'elseif': self._handle_elseif,
+            'end': self._handle_end,
+            'repeat': self._handle_repeat,
+            'until': self._handle_until,
+        }
 
     def rename(self) -> List[Token]:
+        kw_handlers = self._kw_handlers
+        eof_type = _EOF
+        keyword_type = _KEYWORD
+        identifier_type = _IDENTIFIER
+        types = self.types
+        values = self.values
+        n = self.length
+        property_mask = self._property_mask
+        active = self.active
         i = 0
-        while i < len(self.tokens):
-            token = self.tokens[i]
-            if token.type == TokenType.EOF:
+        while i < n:
+            token_type = types[i]
+            if token_type is eof_type:
                 break
-            if token.type == TokenType.KEYWORD:
-                handler = getattr(self, f"_handle_{token.value}", None)
+            if token_type is keyword_type:
+                handler = kw_handlers.get(values[i])
                 if handler:
                     i = handler(i)
                     continue
-            if token.type == TokenType.IDENTIFIER:
-                self._replace_identifier(i)
+            if token_type is identifier_type and not property_mask[i]:
+                # Most identifiers are globals, which miss `active` entirely
+                renames = active.get(values[i])
+                if renames:
+                    values[i] = renames[-1]
             i += 1
+
+        # Only identifier tokens are written back; operator and symbol
+        # tokens may be shared instances
+        for token, token_type, value in zip(self.tokens, types, values):
+            if token_type is identifier_type and token.value is not value:
+                token.value = value
         return self.tokens
 
     # -----------------
     # Scope management
     # -----------------
 
-    def _push_scope(self, block_type: str):
-        self.scope_stack.append({})
+    def _push_scope(self, block_type: int) -> None:
+        pool = self._scope_pool
+        self.scope_names.append(pool.pop() if pool else [])
         self.block_stack.append(block_type)
 
-    def _pop_scope(self):
+    def _pop_scope(self) -> None:
         if self.block_stack:
             self.block_stack.pop()
-        if len(self.scope_stack) > 1:
-            self.scope_stack.pop()
+        if len(self.scope_names) > 1:
+            active = self.active
+            names = self.scope_names.pop()
+            for name in names:
+                # Emptied stacks are kept so redeclaring the name reuses them
+                active[name].pop()
+            names.clear()
+            self._scope_pool.append(names)
 
-    def _pop_until(self, *block_types: str):
+    def _pop_until(self, *block_types: int) -> None:
         while self.block_stack:
             block = self.block_stack[-1]
             self._pop_scope()
@@ -60,158 +140,203 @@ class VariableRenamer:
         if name == '_' or name.startswith('...'):
             return name
         if name.startswith('__PROM_'):
-            self.scope_stack[-1][name] = name
-            return name
-        new_name = self.generator.next_name()
-        self.scope_stack[-1][name] = new_name
+            new_name = name
+        else:
+            new_name = self.generator.next_name()
+        self.scope_names[-1].append(name)
+        self.active.setdefault(name, []).append(new_name)
         return new_name
 
-    def _resolve(self, name: str) -> Optional[str]:
-        for scope in reversed(self.scope_stack):
-            if name in scope:
-                return scope[name]
-        return None
-
     # -----------------
     # Helpers
     # -----------------
 
-    def _previous_token(self, index: int) -> Optional[Token]:
-        if index <= 0:
-            return None
-        return self.tokens[index - 1]
-
-    def _next_token(self, index: int) -> Optional[Token]:
-        if index + 1 >= len(self.tokens):
-            return None
-        return self.tokens[index + 1]
-
-    def _is_property_access(self, index: int) -> bool:
-        prev_token = self._previous_token(index)
-        next_token = self._next_token(index)
-        if prev_token and prev_token.value in ('.', ':', '::'):
-            return True
-        if next_token and next_token.value == '::':
-            return True
-        return False
-
-    def _skip_type_annotation(self, index: int) -> int:
-        i = index
-        if i < len(self.tokens) and self.tokens[i].value == ':':
-            i += 1
-            depth = 0
-            while i < len(self.tokens):
-                token = self.tokens[i]
-                if depth == 0 and token.value in (',', '=', ')', ';'):  # end of annotation
-                    break
-                if token.value in ('<', '(', '['):
-                    depth += 1
-                elif token.value in ('>', ')', ']'):
-                    if depth > 0:
-                        depth -= 1
-                    else:
-                        break
-                i += 1
-        return i
+    def _compute_property_mask(self) -> bytearray:
+        """Flag tokens preceded by `.`/`:`/`::` or followed by `::`"""
+        values = self.values
+        mask = bytearray(self.length)
+        for i, value in enumerate(values):
+            if value == '.' or value == ':':
+                if i + 1 < self.length:
+                    mask[i + 1] = 1
+            elif value == '::':
+                if i + 1 < self.length:
+                    mask[i + 1] = 1
+                if i > 0:
+                    mask[i - 1] = 1
+        return mask
 
-    def _replace_identifier(self, index: int):
-        if self._is_property_access(index):
-            return
-        name = self.tokens[index].value
-        replacement = self._resolve(name)
-        if replacement:
-            self.tokens[index] = self.tokens[index].copy_with(replacement)
+    def _annotation_kind_table(self) -> bytes:
+        kinds = self._annotation_kinds
+        if kinds is None:
+            kinds = bytes(_ANNOTATION_KINDS.get(value, 0) for value in self.values)
+            self._annotation_kinds = kinds
+        return kinds
 
     # -----------------
     # Keyword handlers
     # -----------------
+    #
+    # The declaration handlers skip type annotations inline: after a
+    # declared name followed by `:`, `depth` tracks bracket nesting and
+    # the annotation ends (without consuming the token) on `,` `=` `)` `;`
+    # or an unmatched closing bracket at depth 0.
 
     def _handle_local(self, index: int) -> int:
+        types = self.types
+        values = self.values
+        n = self.length
         i = index + 1
-        if i < len(self.tokens) and self.tokens[i].type == TokenType.KEYWORD and self.tokens[i].value == 'function':
+        if i < n and types[i] is _KEYWORD and values[i] == 'function':
             # local function definition
             name_index = i + 1
-            if name_index < len(self.tokens) and self.tokens[name_index].type == TokenType.IDENTIFIER:
-                new_name = self._declare(self.tokens[name_index].value)
-                self.tokens[name_index] = self.tokens[name_index].copy_with(new_name)
+            if name_index < n and types[name_index] is _IDENTIFIER:
+                values[name_index] = self._declare(values[name_index])
             return index + 1  # continue with function handler
 
-        while i < len(self.tokens):
-            token = self.tokens[i]
-            if token.type == TokenType.IDENTIFIER:
-                new_name = self._declare(token.value)
-                self.tokens[i] = token.copy_with(new_name)
-                i = self._skip_type_annotation(i + 1)
-                if i < len(self.tokens) and self.tokens[i].value == ',':
+        annotations = self.TYPE_ANNOTATIONS
+        kinds = b''
+        in_annotation = False
+        after_name = False
+        depth = 0
+        while i < n:
+            if in_annotation:
+                bit = 1 << kinds[i]
+                if bit & _ANNOTATION_OPEN:
+                    depth += 1
+                elif depth == 0:
+                    if bit & _ANNOTATION_STOP:
+                        in_annotation = False
+                        continue
+                elif bit & _ANNOTATION_CLOSE:
+                    depth -= 1
+                i += 1
+                continue
+            if after_name:
+                # only a `,` may follow a declared name
+                if values[i] != ',':
+                    break
+                after_name = False
+                i += 1
+                continue
+            if types[i] is _IDENTIFIER:
+                values[i] = self._declare(values[i])
+                i += 1
+                after_name = True
+                if annotations and i < n and values[i] == ':':
+                    kinds = self._annotation_kind_table()
+                    in_annotation = True
+                    depth = 0
                     i += 1
-                    continue
-                break
-            if token.value == ',':
+                continue
+            if values[i] == ',':
                 i += 1
                 continue
             break
         return i
 
     def _handle_function(self, index: int) -> int:
-        self._push_scope('function')
+        types = self.types
+        values = self.values
+        n = self.length
+        self._push_scope(_FUNCTION_BLOCK)
         i = index + 1
         # Skip function name (supports foo.bar:baz)
-        while i < len(self.tokens) and self.tokens[i].value != '(':
+        while i < n and values[i] != '(':
             i += 1
-        if i >= len(self.tokens):
+        if i >= n:
             return i
         i += 1  # skip '('
-        while i < len(self.tokens) and self.tokens[i].value != ')':
-            token = self.tokens[i]
-            if token.type == TokenType.IDENTIFIER and token.value != '...':
-                new_name = self._declare(token.value)
-                self.tokens[i] = token.copy_with(new_name)
-                i = self._skip_type_annotation(i + 1)
+        annotations = self.TYPE_ANNOTATIONS
+        kinds = b''
+        in_annotation = False
+        depth = 0
+        while i < n:
+            if in_annotation:
+                bit = 1 << kinds[i]
+                if bit & _ANNOTATION_OPEN:
+                    depth += 1
+                elif depth == 0:
+                    if bit & _ANNOTATION_STOP:
+                        in_annotation = False
+                        continue
+                elif bit & _ANNOTATION_CLOSE:
+                    depth -= 1
+                i += 1
                 continue
-            if token.value in (',', '...'):
+            value = values[i]
+            if value == ')':
+                break
+            if types[i] is _IDENTIFIER and value != '...':
+                values[i] = self._declare(value)
                 i += 1
+                if annotations and i < n and values[i] == ':':
+                    kinds = self._annotation_kind_table()
+                    in_annotation = True
+                    depth = 0
+                    i += 1
                 continue
             i += 1
         return i
 
     def _handle_for(self, index: int) -> int:
-        self._push_scope('for')
-        self.pending_for_scopes.append(True)
+        types = self.types
+        values = self.values
+        n = self.length
+        self._push_scope(_FOR_BLOCK)
+        self.pending_for_scopes += 1
         i = index + 1
-        while i < len(self.tokens):
-            token = self.tokens[i]
-            if token.type == TokenType.IDENTIFIER:
-                new_name = self._declare(token.value)
-                self.tokens[i] = token.copy_with(new_name)
-                i = self._skip_type_annotation(i + 1)
+        annotations = self.TYPE_ANNOTATIONS
+        kinds = b''
+        in_annotation = False
+        depth = 0
+        while i < n:
+            if in_annotation:
+                bit = 1 << kinds[i]
+                if bit & _ANNOTATION_OPEN:
+                    depth += 1
+                elif depth == 0:
+                    if bit & _ANNOTATION_STOP:
+                        in_annotation = False
+                        continue
+                elif bit & _ANNOTATION_CLOSE:
+                    depth -= 1
+                i += 1
                 continue
-            if token.value == ',':
+            value = values[i]
+            if types[i] is _IDENTIFIER:
+                values[i] = self._declare(value)
                 i += 1
+                if annotations and i < n and values[i] == ':':
+                    kinds = self._annotation_kind_table()
+                    in_annotation = True
+                    depth = 0
+                    i += 1
                 continue
-            if token.value in ('=', 'in'):
+            if value in ('=', 'in'):
                 break
             i += 1
         return i
 
     def _handle_do(self, index: int) -> int:
-        if self.pending_for_scopes and self.pending_for_scopes[-1]:
-            self.pending_for_scopes.pop()
+        if self.pending_for_scopes:
+            self.pending_for_scopes -= 1
             return index + 1
-        self._push_scope('do')
+        self._push_scope(_DO_BLOCK)
         return index + 1
 
     def _handle_then(self, index: int) -> int:
-        self._push_scope('then')
+        self._push_scope(_THEN_BLOCK)
         return index + 1
 
     def _handle_else(self, index: int) -> int:
-        self._pop_until('then', 'elseif')
-        self._push_scope('else')
+        self._pop_until(_THEN_BLOCK, _ELSEIF_BLOCK)
+        self._push_scope(_ELSE_BLOCK)
         return index + 1
 
     def _handle_elseif(self, index: int) -> int:
-        self._pop_until('then', 'elseif')
-        self._push_scope('elseif')
+        self._pop_until(_THEN_BLOCK, _ELSEIF_BLOCK)
+        self._push_scope(_ELSEIF_BLOCK)
         return index + 1
 
     def _handle_end(self, index: int) -> int:
@@ -219,9 +344,47 @@ class VariableRenamer:
         return index + 1
 
     def _handle_repeat(self, index: int) -> int:
-        self._push_scope('repeat')
+        self._push_scope(_REPEAT_BLOCK)
         return index + 1
 
     def _handle_until(self, index: int) -> int:
-        self._pop_until('repeat')
+        self._pop_until(_REPEAT_BLOCK)
         return index + 1
+
+
+class SteplessVariableRenamer(VariableRenamer):
+    """Renamer for pipelines without steps, so no `__PROM_` helpers exist
+
+    User locals named `__PROM_*` are renamed like any other local.
+    """
+
+    def _declare(self, name: str) -> str:
+        if name == '_' or name.startswith('...'):
+            return name
+        new_name = self.generator.next_name()
+        self.scope_names[-1].append(name)
+        self.active.setdefault(name, []).append(new_name)
+        return new_name
+
+
+class Lua51VariableRenamer(VariableRenamer):
+    """Renamer for Lua 5.1, which has no type annotations to skip"""
+
+    TYPE_ANNOTATIONS = False
+
+
+class SteplessLua51VariableRenamer(SteplessVariableRenamer):
+    """Renamer for step-less Lua 5.1 pipelines"""
+
+    TYPE_ANNOTATIONS = False
+
+
+def create_renamer(tokens: List[Token], generator: NameGenerator, keywords: AbstractSet[str],
+                   lua_version: str = 'LuaU', has_steps: bool = True) -> VariableRenamer:
+    """Factory picking the renamer specialised for the pipeline setup"""
+    renamer_class: type[VariableRenamer]
+    if lua_version == 'Lua51':
+        renamer_class = Lua51VariableRenamer if has_steps else SteplessLua51VariableRenamer
+    else:
+        renamer_class = VariableRenamer if has_steps else SteplessVariableRenamer
+    return renamer_class(tokens, generator, keywords)
@@ -2,11 +2,62 @@
 
 from __future__ import annotations
 
-import textwrap
+import functools
+from collections import Counter
 from typing import List
 
-from .parser import Module
-from .tokenizer import Token, TokenType
+from .parser import Module, TokenRope
+from .tokenizer import Token, TokenType, Tokenizer
+from .unparser import escape_string
+
+# Strings at least this long are encoded with numpy when it is installed;
+# below it the array setup costs more than the plain Python loop
+NUMPY_MIN_LENGTH = 64
+
+# Decimal text of every byte value, for serialising byte tables and keys
+_BYTE_STRS = tuple(str(value) for value in range(256))
+
+# Tokens of fixed helper snippets, keyed by Lua version and source; callers
+# get copies they may patch
+_HELPER_TOKEN_CACHE: dict[tuple[str, str], List[Token]] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _load_numpy():
+    """Import numpy on first use, returning None if it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _encode_string(value: str, key: int) -> List[int]:
+    """Encode each character as (code point + key + position) % 256"""
+    np = _load_numpy() if len(value) >= NUMPY_MIN_LENGTH else None
+    if np is None:
+        return [(ord(char) + key + idx) % 256 for idx, char in enumerate(value, start=1)]
+    # '<u4' matches the little-endian encoding on any host byte order
+    code_points = np.frombuffer(value.encode('utf-32-le', 'surrogatepass'), dtype='<u4').astype(np.int64)
+    positions = np.arange(1, len(value) + 1, dtype=np.int64)
+    return ((code_points + key + positions) % 256).tolist()
+
+
+# Shared, immutable operator and symbol tokens for the code steps build
+_SHARED = Tokenizer.SHARED_TOKENS
+
+
+def _byte_tokens(values) -> List[Token]:
+    """Tokens of a comma separated list of byte values"""
+    if not values:
+        return []
+    # Numbers in the even slots and the shared, never mutated comma token
+    # between them
+    tokens = [_SHARED[',']] * (2 * len(values) - 1)
+    number_type = TokenType.NUMBER
+    byte_strs = _BYTE_STRS
+    tokens[::2] = [Token(number_type, byte_strs[value], 0, 0) for value in values]
+    return tokens
 
 
 class BaseStep:
@@ -23,49 +74,71 @@ class BaseStep:
     def _code_to_tokens(self, code: str, context) -> List[Token]:
         return context.tokens_from_code(code)
 
-    def _indent(self, code: str, indent: str = '    ') -> str:
-        return textwrap.indent(code, indent)
+    def _helper_tokens(self, code: str, context) -> List[Token]:
+        """Tokenize a fixed helper snippet once, returning fresh copies"""
+        key = (context.tokenizer.lua_version, code)
+        tokens = _HELPER_TOKEN_CACHE.get(key)
+        if tokens is None:
+            tokens = _HELPER_TOKEN_CACHE[key] = self._code_to_tokens(code, context)
+        # Later passes rename token values in place, so only the shared operator
+        # and symbol tokens are handed out as-is; the rest are positionless copies
+        return [
+            token if token is _SHARED.get(token.value) else Token(token.type, token.value, 0, 0)
+            for token in tokens
+        ]
 
 
 class EncryptStringsStep(BaseStep):
     NAME = "EncryptStrings"
 
+    HELPER_CODE = (
+        "local function __PROM_STR(bytes, key)\n"
+        "    local out = {}\n"
+        "    for i = 1, #bytes do\n"
+        "        local value = (bytes[i] - key - i) % 256\n"
+        "        out[i] = string.char(value)\n"
+        "    end\n"
+        "    return table.concat(out)\n"
+        "end\n"
+    )
+
     def apply(self, module: Module, context):
-        body_tokens = module.tokens[:-1]
-        eof = module.tokens[-1]
-        rng = context.random
+        body_tokens, eof = module.split_eof()
+        # Drawn one key at a time from the shared seeded stream; batching
+        # through numpy would change the output for a given Seed
+        randint = context.random.randint
         threshold = int(self.settings.get('MinLength', 1))
         transformed = False
         new_tokens: List[Token] = []
 
         for token in body_tokens:
             if token.type == TokenType.STRING and len(token.value) >= threshold:
-                key = rng.randint(5, 40)
-                encoded = [(ord(char) + key + idx) % 256 for idx, char in enumerate(token.value, start=1)]
-                table_literal = '{' + ','.join(str(value) for value in encoded) + '}'
-                expr = f"__PROM_STR({table_literal}, {key})"
-                new_tokens.extend(self._code_to_tokens(expr, context))
+                key = randint(5, 40)
+                encoded = _encode_string(token.value, key)
+                new_tokens.extend(self._call_tokens(encoded, key))
                 transformed = True
             else:
                 new_tokens.append(token)
 
         if transformed:
-            helper_code = (
-                "local function __PROM_STR(bytes, key)\n"
-                "    local out = {}\n"
-                "    for i = 1, #bytes do\n"
-                "        local value = (bytes[i] - key - i) % 256\n"
-                "        out[i] = string.char(value)\n"
-                "    end\n"
-                "    return table.concat(out)\n"
-                "end\n"
-            )
-            helper_tokens = self._code_to_tokens(helper_code, context)
-            module.tokens = helper_tokens + new_tokens + [eof]
-        else:
-            module.tokens = body_tokens + [eof]
+            helper_tokens = self._helper_tokens(self.HELPER_CODE, context)
+            module.tokens = TokenRope([helper_tokens, new_tokens, [eof]])
         return module
 
+    def _call_tokens(self, encoded: List[int], key: int) -> List[Token]:
+        """Tokens of `__PROM_STR({encoded...}, key)`, built without the tokenizer"""
+        tokens = [
+            Token(TokenType.IDENTIFIER, '__PROM_STR', 0, 0),
+            _SHARED['('],
+            _SHARED['{'],
+        ]
+        tokens += _byte_tokens(encoded)
+        tokens.append(_SHARED['}'])
+        tokens.append(_SHARED[','])
+        tokens.append(Token(TokenType.NUMBER, _BYTE_STRS[key], 0, 0))
+        tokens.append(_SHARED[')'])
+        return tokens
+
 
 class ConstantArrayStep(BaseStep):
     NAME = "ConstantArray"
@@ -73,29 +146,28 @@ class ConstantArrayStep(BaseStep):
     def apply(self, module: Module, context):
         threshold = int(self.settings.get('Threshold') or self.settings.get('Treshold') or 2)
         strings_only = bool(self.settings.get('StringsOnly', True))
-        body_tokens = module.tokens[:-1]
-        eof = module.tokens[-1]
+        body_tokens, eof = module.split_eof()
 
-        counts = {}
-        for token in body_tokens:
-            if token.type == TokenType.STRING:
-                key = (TokenType.STRING, token.value)
-            elif not strings_only and token.type == TokenType.NUMBER:
-                key = (TokenType.NUMBER, token.value)
-            else:
-                continue
-            counts[key] = counts.get(key, 0) + 1
+        string_type = TokenType.STRING
+        number_type = TokenType.NUMBER
+        if strings_only:
+            keys = ((string_type, token.value) for token in body_tokens if token.type is string_type)
+        else:
+            keys = (
+                (token.type, token.value) for token in body_tokens
+                if token.type is string_type or token.type is number_type
+            )
+        counts = Counter(keys)
 
         replacements = {key: idx + 1 for idx, (key, count) in enumerate(counts.items()) if count >= threshold}
         if not replacements:
-            module.tokens = body_tokens + [eof]
             return module
 
         array_entries = []
         for key, index in replacements.items():
             token_type, value = key
             if token_type == TokenType.STRING:
-                array_entries.append(f'[{index}] = "{value.replace("\\", "\\\\").replace("\"", "\\\"")}"')
+                array_entries.append(f'[{index}] = "{escape_string(value)}"')
             else:
                 array_entries.append(f'[{index}] = {value}')
         array_code = f"local __PROM_CONST = {{{', '.join(array_entries)}}}\n"
@@ -103,120 +175,154 @@ class ConstantArrayStep(BaseStep):
 
         new_tokens: List[Token] = []
         for token in body_tokens:
-            replacement_key = None
-            if token.type == TokenType.STRING:
-                replacement_key = (TokenType.STRING, token.value)
-            elif not strings_only and token.type == TokenType.NUMBER:
-                replacement_key = (TokenType.NUMBER, token.value)
-
-            if replacement_key and replacement_key in replacements:
-                expr = f"__PROM_CONST[{replacements[replacement_key]}]"
-                new_tokens.extend(self._code_to_tokens(expr, context))
-            else:
-                new_tokens.append(token)
-
-        module.tokens = array_tokens + new_tokens + [eof]
+            token_type = token.type
+            if token_type is string_type or (token_type is number_type and not strings_only):
+                const_index = replacements.get((token_type, token.value))
+                if const_index is not None:
+                    # The tokens of `__PROM_CONST[const_index]`
+                    new_tokens.extend((
+                        Token(TokenType.IDENTIFIER, '__PROM_CONST', 0, 0),
+                        _SHARED['['],
+                        Token(TokenType.NUMBER, str(const_index), 0, 0),
+                        _SHARED[']'],
+                    ))
+                    continue
+            new_tokens.append(token)
+
+        module.tokens = TokenRope([array_tokens, new_tokens, [eof]])
         return module
 
 
 class WrapInFunctionStep(BaseStep):
     NAME = "WrapInFunction"
 
+    PREFIX_CODE = "return (function()\n"
+    SUFFIX_CODE = "\nend)()\n"
+
     def apply(self, module: Module, context):
-        source = context.render(module)
-        wrapped = (
-            "return (function()\n"
-            f"{self._indent(source)}\n"
-            "end)()\n"
-        )
-        return context.module_from_source(wrapped)
+        body_tokens, eof = module.split_eof()
+        module.tokens = TokenRope([
+            self._helper_tokens(self.PREFIX_CODE, context),
+            body_tokens,
+            self._helper_tokens(self.SUFFIX_CODE, context),
+            [eof],
+        ])
+        return module
 
 
 class VmifyStep(BaseStep):
     NAME = "Vmify"
 
+    PREFIX_CODE = "local __PROM_DATA = {"
+    SUFFIX_CODE = (
+        "}\n"
+        "local __PROM_LOAD = loadstring or load\n"
+        "local __PROM_BUFFER = {}\n"
+        "for i = 1, #__PROM_DATA do\n"
+        "    __PROM_BUFFER[i] = string.char(__PROM_DATA[i])\n"
+        "end\n"
+        "local __PROM_SOURCE = table.concat(__PROM_BUFFER)\n"
+        "return __PROM_LOAD(__PROM_SOURCE)()\n"
+    )
+
     def apply(self, module: Module, context):
+        # The program itself is embedded as bytes, so it still has to be rendered
         source = context.render(module)
-        data = ','.join(str(byte) for byte in source.encode('utf-8'))
-        vm_code = (
-            "local __PROM_DATA = {" + data + "}\n"
-            "local __PROM_LOAD = loadstring or load\n"
-            "local __PROM_BUFFER = {}\n"
-            "for i = 1, #__PROM_DATA do\n"
-            "    __PROM_BUFFER[i] = string.char(__PROM_DATA[i])\n"
-            "end\n"
-            "local __PROM_SOURCE = table.concat(__PROM_BUFFER)\n"
-            "return __PROM_LOAD(__PROM_SOURCE)()\n"
-        )
-        return context.module_from_source(vm_code)
+        _, eof = module.split_eof()
+        module.tokens = TokenRope([
+            self._helper_tokens(self.PREFIX_CODE, context),
+            _byte_tokens(source.encode('utf-8')),
+            self._helper_tokens(self.SUFFIX_CODE, context),
+            [eof],
+        ])
+        return module
 
 
 class AntiTamperStep(BaseStep):
     NAME = "AntiTamper"
 
+    # Stands in for the sentinel while the helper template is tokenized
+    SENTINEL_PLACEHOLDER = '0x0'
+
+    HELPER_CODE = (
+        f"local __PROM_SENTINEL = {SENTINEL_PLACEHOLDER}\n"
+        "local function __PROM_TAMPER(value)\n"
+        "    if value ~= __PROM_SENTINEL then\n"
+        "        error('Tampering detected', 0)\n"
+        "    end\n"
+        "end\n"
+        f"__PROM_TAMPER(({SENTINEL_PLACEHOLDER} ~ {SENTINEL_PLACEHOLDER}) ~ 0)\n"
+    )
+
     def apply(self, module: Module, context):
         rng = context.random
-        sentinel = rng.randint(10_000, 99_999)
-        check_code = (
-            f"local __PROM_SENTINEL = {sentinel}\n"
-            "local function __PROM_TAMPER(value)\n"
-            "    if value ~= __PROM_SENTINEL then\n"
-            "        error('Tampering detected', 0)\n"
-            "    end\n"
-            "end\n"
-            f"__PROM_TAMPER(({sentinel} ~ {sentinel}) ~ 0)\n"
-        )
-        helper_tokens = self._code_to_tokens(check_code, context)
-        body_tokens = module.tokens[:-1]
-        eof = module.tokens[-1]
-        module.tokens = helper_tokens + body_tokens + [eof]
+        sentinel = str(rng.randint(10_000, 99_999))
+        helper_tokens = self._helper_tokens(self.HELPER_CODE, context)
+        for token in helper_tokens:
+            if token.type is TokenType.NUMBER and token.value == self.SENTINEL_PLACEHOLDER:
+                token.value = sentinel
+        module.tokens = TokenRope([helper_tokens, module.tokens])
         return module
 
 
 class ControlFlowFlatteningStep(BaseStep):
     NAME = "ControlFlowFlattening"
 
+    PREFIX_CODE = (
+        "local function __PROM_FLOW()\n"
+        "    local __PROM_STATE = 0\n"
+        "    while true do\n"
+        "        if __PROM_STATE == 0 then\n"
+    )
+    SUFFIX_CODE = (
+        "\n"
+        "            __PROM_STATE = -1\n"
+        "        else\n"
+        "            break\n"
+        "        end\n"
+        "    end\n"
+        "end\n"
+        "__PROM_FLOW()\n"
+    )
+
     def apply(self, module: Module, context):
-        source = context.render(module)
-        flattened = (
-            "local function __PROM_FLOW()\n"
-            "    local __PROM_STATE = 0\n"
-            "    while true do\n"
-            "        if __PROM_STATE == 0 then\n"
-            f"{self._indent(source, '            ')}\n"
-            "            __PROM_STATE = -1\n"
-            "        else\n"
-            "            break\n"
-            "        end\n"
-            "    end\n"
-            "end\n"
-            "__PROM_FLOW()\n"
-        )
-        return context.module_from_source(flattened)
+        body_tokens, eof = module.split_eof()
+        module.tokens = TokenRope([
+            self._helper_tokens(self.PREFIX_CODE, context),
+            body_tokens,
+            self._helper_tokens(self.SUFFIX_CODE, context),
+            [eof],
+        ])
+        return module
 
 
 class NumbersToExpressionsStep(BaseStep):
     NAME = "NumbersToExpressions"
 
     def apply(self, module: Module, context):
-        body_tokens = module.tokens[:-1]
-        eof = module.tokens[-1]
-        rng = context.random
+        body_tokens, eof = module.split_eof()
+        randint = context.random.randint
         new_tokens: List[Token] = []
         for token in body_tokens:
             if token.type == TokenType.NUMBER:
                 value = token.value
                 parsed = self._parse_number(value)
                 if parsed is not None and abs(parsed) > 3:
-                    a = rng.randint(1, abs(parsed) - 1)
+                    a = randint(1, abs(parsed) - 1)
                     b = parsed - a if parsed >= 0 else -(abs(parsed) - a)
-                    expr = f"({a}+{b})"
-                    new_tokens.extend(self._code_to_tokens(expr, context))
+                    # The tokens of `(a+b)`, built directly rather than re-tokenized
+                    new_tokens.extend((
+                        _SHARED['('],
+                        Token(TokenType.NUMBER, str(a), 0, 0),
+                        _SHARED['+'],
+                        Token(TokenType.NUMBER, str(b), 0, 0),
+                        _SHARED[')'],
+                    ))
                 else:
                     new_tokens.append(token)
             else:
                 new_tokens.append(token)
-        module.tokens = new_tokens + [eof]
+        module.tokens = TokenRope([new_tokens, [eof]])
         return module
 
     def _parse_number(self, value: str) -> int | None:
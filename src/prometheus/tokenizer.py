@@ -3,9 +3,10 @@ Prometheus Tokenizer
 Tokenizes Lua/LuaU source code into tokens
 """
 
-from dataclasses import dataclass
+import re
+import sys
 from enum import Enum
-from typing import List
+from typing import ClassVar, Dict, FrozenSet, List, Set, Tuple
 
 
 class TokenType(Enum):
@@ -19,13 +20,61 @@ class TokenType(Enum):
     SYMBOL = 'SYMBOL'
 
 
-@dataclass
+def _build_master_pattern(multi_ops, single_ops, symbols) -> re.Pattern:
+    """Build the single alternation the tokenizer scans with"""
+    operators = '|'.join(re.escape(op) for op in sorted(multi_ops, key=len, reverse=True))
+    return re.compile(
+        r'[ \t\r]*(?:'
+        r'(?P<NEWLINE>\n[ \t\r\n]*)'
+        r'|(?P<IDENTIFIER>[A-Za-z_]\w*)'
+        r'|(?P<LONG_COMMENT>--\[=*\[)'
+        r'|(?P<COMMENT>--[^\n]*)'
+        r'|(?P<LONG_STRING>\[=*\[)'
+        # Strings unrolled as plain runs between escapes; an unterminated
+        # string runs to the end of the source
+        r'|(?P<STRING>"(?P<dbody>[^"\\]*(?:\\.[^"\\]*)*\\?)(?P<dend>"?)'
+        r"|'(?P<sbody>[^'\\]*(?:\\.[^'\\]*)*\\?)(?P<send>'?))"
+        r'|(?P<NUMBER>0[xX][0-9a-fA-F]*|(?:[0-9]|\.[0-9])[0-9.]*(?:[eE][-+]?[0-9]*)?)'
+        r'|(?P<DOT>\.(?=[^\x00-\x7f]))'
+        rf'|(?P<OPERATOR>{operators}|[{re.escape("".join(sorted(single_ops)))}])'
+        rf'|(?P<SYMBOL>[{re.escape("".join(sorted(symbols)))}])'
+        r'|(?P<OTHER>.))',
+        re.DOTALL,
+    )
+
+
+# `\w` matches exactly the characters for which str.isalnum() holds, plus `_`
+_IDENTIFIER_REST = re.compile(r'\w*')
+
+# Escape sequences inside a quoted string; the backslash takes no column
+_STRING_ESCAPE = re.compile(r'\\.', re.DOTALL)
+
+
 class Token:
-    """Represents a single token"""
-    type: TokenType
-    value: str
-    line: int
-    column: int
+    """Represents a single token
+
+    Operator and symbol tokens may be shared instances (see
+    Tokenizer.SHARED_TOKENS) and must never be mutated; copy them with
+    copy_with instead. A line and column of 0 means the token has no
+    position: shared tokens, and tokens built by obfuscation steps.
+    """
+    # A plain class rather than a dataclass: dataclass(slots=True) needs
+    # Python 3.10, and mypyc cannot compile a dataclass with __slots__
+    __slots__ = ('type', 'value', 'line', 'column')
+
+    def __init__(self, type: TokenType, value: str, line: int, column: int):
+        self.type = type
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __repr__(self) -> str:
+        return f'Token(type={self.type!r}, value={self.value!r}, line={self.line!r}, column={self.column!r})'
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        return (self.type, self.value, self.line, self.column) == (other.type, other.value, other.line, other.column)
 
     def copy_with(self, value: str):
         return Token(self.type, value, self.line, self.column)
@@ -34,207 +83,187 @@ class Token:
 class Tokenizer:
     """Tokenizer for Lua/LuaU code"""
 
-    KEYWORDS = {
+    # The tables are ClassVars so a mypyc build keeps them on the class
+    # instead of turning them into per-instance attribute defaults
+    KEYWORDS: ClassVar[FrozenSet[str]] = frozenset({
         'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for',
         'function', 'if', 'in', 'local', 'nil', 'not', 'or', 'repeat',
         'return', 'then', 'true', 'until', 'while'
-    }
+    })
+
+    LUAU_KEYWORDS: ClassVar[FrozenSet[str]] = frozenset({'continue', 'type', 'export'})
 
-    LUAU_KEYWORDS = {'continue', 'type', 'export'}
+    # Shared by every LuaU tokenizer instance
+    ALL_LUAU_KEYWORDS: ClassVar[FrozenSet[str]] = KEYWORDS | LUAU_KEYWORDS
 
-    MULTI_CHAR_OPERATORS = (
+    MULTI_CHAR_OPERATORS: ClassVar[Tuple[str, ...]] = (
         '..<', '::', '==', '~=', '<=', '>=', '..', '//', '...'
     )
 
-    SINGLE_CHAR_OPERATORS = set('+-*/%^#=<>')
+    SINGLE_CHAR_OPERATORS: ClassVar[Set[str]] = set('+-*/%^#=<>')
+
+    SYMBOLS: ClassVar[Set[str]] = set('(){}[];,.:')
+
+    # Matched against the str itself: ASCII source is already stored one byte
+    # per character, so scanning encoded bytes is no faster and would shift
+    # the columns of everything after a non-ASCII character
+    MASTER_PATTERN: ClassVar[re.Pattern] = _build_master_pattern(MULTI_CHAR_OPERATORS, SINGLE_CHAR_OPERATORS, SYMBOLS)
 
-    SYMBOLS = set('(){}[];,.:')
+    # One positionless token per operator and symbol, shared when positions
+    # are off; these must never be mutated
+    SHARED_TOKENS: ClassVar[Dict[str, Token]] = {
+        **{op: Token(TokenType.OPERATOR, sys.intern(op), 0, 0) for op in (*MULTI_CHAR_OPERATORS, *SINGLE_CHAR_OPERATORS)},
+        **{symbol: Token(TokenType.SYMBOL, symbol, 0, 0) for symbol in SYMBOLS},
+    }
 
-    def __init__(self, lua_version: str = 'LuaU'):
+    def __init__(self, lua_version: str = 'LuaU', track_positions: bool = True):
         self.lua_version = lua_version
-        self.keywords = set(self.KEYWORDS)
-        if lua_version == 'LuaU':
-            self.keywords.update(self.LUAU_KEYWORDS)
+        self.keywords = self.ALL_LUAU_KEYWORDS if lua_version == 'LuaU' else self.KEYWORDS
+        # Without positions, operator and symbol tokens are shared instances
+        # and must not be mutated
+        self.track_positions = track_positions
 
     def tokenize(self, source: str) -> List[Token]:
         tokens: List[Token] = []
-        i = 0
-        line = 1
-        column = 1
+        append = tokens.append
         length = len(source)
+        line = 1
+        # Columns are tracked as an offset from the current line start
+        base = -1
+
+        finditer = self.MASTER_PATTERN.finditer
+        keywords = self.keywords
+        intern = sys.intern
+        keyword_type = TokenType.KEYWORD
+        identifier_type = TokenType.IDENTIFIER
+        operator_type = TokenType.OPERATOR
+        symbol_type = TokenType.SYMBOL
+        shared = None if self.track_positions else self.SHARED_TOKENS
+
+        pos = 0
+        while pos < length:
+            for m in finditer(source, pos):
+                kind = m.lastgroup
+
+                if kind == 'SYMBOL':
+                    if shared is not None:
+                        append(shared[m.group(kind)])
+                        continue
+                    start = m.start(kind)
+                    append(Token(symbol_type, source[start], line, start - base))
+                    continue
 
-        while i < length:
-            ch = source[i]
+                if kind == 'IDENTIFIER':
+                    start = m.start(kind)
+                    # Interned so keyword/name comparisons downstream hit the
+                    # identity fast path
+                    value = intern(m.group(kind))
+                    append(Token(keyword_type if value in keywords else identifier_type, value, line, start - base))
+                    continue
 
-            # Whitespace
-            if ch in ' \t\r':
-                i, column = self._consume_whitespace(source, i, column)
-                continue
-            if ch == '\n':
-                i += 1
-                line += 1
-                column = 1
-                continue
-
-            # Comments
-            if ch == '-' and self._peek(source, i + 1) == '-':
-                i, line, column = self._consume_comment(source, i, line, column)
-                continue
-
-            # Long strings
-            if ch == '[':
-                long_string = self._consume_long_string(source, i, line, column)
-                if long_string is not None:
-                    value, consumed, new_lines, tail_len = long_string
-                    tokens.append(Token(TokenType.STRING, value, line, column))
-                    line += new_lines
-                    if new_lines:
-                        column = tail_len + 1
-                    else:
-                        column += consumed
-                    i += consumed
+                if kind == 'NEWLINE':
+                    start, end = m.span(kind)
+                    line += source.count('\n', start, end)
+                    base = source.rfind('\n', start, end)
                     continue
 
-            # Strings
-            if ch in ('"', "'"):
-                value, consumed, new_lines, line_len = self._consume_string(source, i)
-                tokens.append(Token(TokenType.STRING, value, line, column))
-                line += new_lines
-                if new_lines:
-                    column = line_len + 1
-                else:
-                    column += consumed
-                i += consumed
-                continue
-
-            # Numbers
-            if ch.isdigit() or (ch == '.' and self._peek(source, i + 1).isdigit()):
-                value, consumed = self._consume_number(source, i)
-                tokens.append(Token(TokenType.NUMBER, value, line, column))
-                i += consumed
-                column += consumed
-                continue
-
-            # Identifiers/keywords
-            if ch.isalpha() or ch == '_':
-                value, consumed = self._consume_identifier(source, i)
-                token_type = TokenType.KEYWORD if value in self.keywords else TokenType.IDENTIFIER
-                tokens.append(Token(token_type, value, line, column))
-                i += consumed
-                column += consumed
-                continue
-
-            # Multi character operators
-            matched = False
-            for op in sorted(self.MULTI_CHAR_OPERATORS, key=len, reverse=True):
-                if source.startswith(op, i):
-                    tokens.append(Token(TokenType.OPERATOR, op, line, column))
-                    i += len(op)
-                    column += len(op)
-                    matched = True
-                    break
-            if matched:
-                continue
+                if kind == 'OPERATOR':
+                    if shared is not None:
+                        append(shared[m.group(kind)])
+                        continue
+                    start = m.start(kind)
+                    append(Token(operator_type, intern(m.group(kind)), line, start - base))
+                    continue
 
-            # Single char operators and symbols
-            if ch in self.SINGLE_CHAR_OPERATORS:
-                tokens.append(Token(TokenType.OPERATOR, ch, line, column))
-                i += 1
-                column += 1
-                continue
-            if ch in self.SYMBOLS:
-                tokens.append(Token(TokenType.SYMBOL, ch, line, column))
-                i += 1
-                column += 1
-                continue
+                if kind == 'NUMBER':
+                    start, end = m.span(kind)
+                    if end < length and source[end] > '\x7f':
+                        # Non-ASCII digits continue a number as well
+                        value, consumed = self._consume_number(source, start)
+                        append(Token(TokenType.NUMBER, value, line, start - base))
+                        pos = start + consumed
+                        break
+                    append(Token(TokenType.NUMBER, m.group(kind), line, start - base))
+                    continue
+
+                if kind == 'STRING':
+                    start, end = m.span(kind)
+                    if source[start] == '"':
+                        value, closed = m.group('dbody', 'dend')
+                    else:
+                        value, closed = m.group('sbody', 'send')
+                    append(Token(TokenType.STRING, value, line, start - base))
+                    new_lines = value.count('\n')
+                    if new_lines:
+                        # The column after a multi-line string skips its
+                        # escapes and the closing quote
+                        line += new_lines
+                        tail = value[value.rfind('\n') + 1:]
+                        base = end - (len(tail) - len(_STRING_ESCAPE.findall(tail)) + 1)
+                    elif not closed:
+                        # An unterminated string runs past the end of the source
+                        base -= 1
+                    continue
 
-            # Unknown char
-            i += 1
-            column += 1
+                if kind == 'COMMENT':
+                    continue
 
-        tokens.append(Token(TokenType.EOF, '', line, column))
-        return tokens
+                if kind == 'LONG_COMMENT' or kind == 'LONG_STRING':
+                    start, end = m.span(kind)
+                    level = end - start - (4 if kind == 'LONG_COMMENT' else 2)
+                    close = source.find(']' + '=' * level + ']', end)
+                    if close == -1:
+                        # Unclosed brackets are a plain comment or a symbol
+                        if kind == 'LONG_COMMENT':
+                            close = source.find('\n', end)
+                            pos = length if close == -1 else close
+                        else:
+                            append(Token(symbol_type, '[', line, start - base))
+                            pos = start + 1
+                        break
+                    body = source[end:close]
+                    if kind == 'LONG_STRING':
+                        append(Token(TokenType.STRING, body, line, start - base))
+                    pos = close + level + 2
+                    new_lines = body.count('\n')
+                    if new_lines:
+                        # The column after a multi-line long bracket skips the
+                        # closing bracket
+                        line += new_lines
+                        base = pos - (len(body) - body.rfind('\n'))
+                    break
 
-    def _peek(self, source: str, index: int) -> str:
-        if 0 <= index < len(source):
-            return source[index]
-        return '\0'
-
-    def _consume_whitespace(self, source: str, index: int, column: int):
-        while index < len(source) and source[index] in ' \t\r':
-            index += 1
-            column += 1
-        return index, column
-
-    def _consume_comment(self, source: str, index: int, line: int, column: int):
-        index += 2  # skip --
-        column += 2
-        if source.startswith('[', index):
-            long_string = self._consume_long_string(source, index, line, column)
-            if long_string is not None:
-                _, consumed, new_lines, tail_len = long_string
-                line += new_lines
-                if new_lines:
-                    column = tail_len + 1
+                # DOT and OTHER match a single character
+                start = m.end() - 1
+                ch = source[start]
+                if kind == 'DOT':
+                    if not source[start + 1].isdigit():
+                        append(Token(symbol_type, ch, line, start - base))
+                        continue
+                    value, consumed = self._consume_number(source, start)
+                    append(Token(TokenType.NUMBER, value, line, start - base))
+                elif ch.isdigit():
+                    # Non-ASCII digits and letters still start tokens
+                    value, consumed = self._consume_number(source, start)
+                    append(Token(TokenType.NUMBER, value, line, start - base))
+                elif ch.isalpha():
+                    value, consumed = self._consume_identifier(source, start)
+                    value = intern(value)
+                    append(Token(keyword_type if value in keywords else identifier_type, value, line, start - base))
                 else:
-                    column += consumed
-                return index + consumed, line, column
-        while index < len(source) and source[index] != '\n':
-            index += 1
-            column += 1
-        return index, line, column
-
-    def _consume_long_string(self, source: str, index: int, line: int, column: int):
-        equals = 0
-        i = index + 1
-        while i < len(source) and source[i] == '=':
-            equals += 1
-            i += 1
-        if i >= len(source) or source[i] != '[':
-            return None
-        i += 1
-        start = i
-        end_token = ']' + ('=' * equals) + ']'
-        end_pos = source.find(end_token, i)
-        if end_pos == -1:
-            return None
-        value = source[start:end_pos]
-        consumed = end_pos + len(end_token) - index
-        new_lines = value.count('\n')
-        if new_lines:
-            tail_length = len(value.rsplit('\n', 1)[-1])
-        else:
-            tail_length = consumed
-        return value, consumed, new_lines, tail_length
-
-    def _consume_string(self, source: str, index: int):
-        quote = source[index]
-        i = index + 1
-        value = []
-        new_lines = 0
-        last_line_length = 0
-        current_line_length = 0
-        while i < len(source):
-            ch = source[i]
-            if ch == quote:
+                    # Unknown characters are skipped
+                    continue
+                pos = start + consumed
                 break
-            if ch == '\\' and i + 1 < len(source):
-                value.append(ch)
-                i += 1
-                ch = source[i]
-            if ch == '\n':
-                new_lines += 1
-                last_line_length = current_line_length
-                current_line_length = 0
             else:
-                current_line_length += 1
-            value.append(ch)
-            i += 1
-        i += 1  # closing quote
-        consumed = i - index
-        return ''.join(value), consumed, new_lines, current_line_length
+                break
+
+        tokens.append(Token(TokenType.EOF, '', line, length - base))
+        return tokens
 
     def _consume_number(self, source: str, index: int):
+        # Kept as a loop: str.isdigit() also accepts digits such as `²` that
+        # `\d` does not, and only numbers touching non-ASCII text get here
         i = index
         if source.startswith(('0x', '0X'), i):
             i += 2
@@ -252,7 +281,6 @@ class Tokenizer:
         return source[index:i], i - index
 
     def _consume_identifier(self, source: str, index: int):
-        i = index
-        while i < len(source) and (source[i].isalnum() or source[i] == '_'):
-            i += 1
-        return source[index:i], i - index
+        match = _IDENTIFIER_REST.match(source, index)
+        end = match.end() if match else index
+        return source[index:end], end - index
@@ -3,100 +3,129 @@ Prometheus Unparser
 Converts AST back into Lua/LuaU source code
 """
 
+import re
+
 from .tokenizer import TokenType
 
+# Words and single delimiters seen by the pretty printer; whitespace separates words
+_PRETTY_TOKEN = re.compile(r'[(){}\[\];,]|[^\s(){}\[\];,]+')
+
+# Indentation strings for the common nesting depths
+_INDENTS = tuple('    ' * depth for depth in range(32))
+
+
+def escape_string(value):
+    """Escape a string body for a double-quoted Lua literal"""
+    # Two replace calls beat str.translate here: they scan in C and return
+    # the original string untouched when there is nothing to escape
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
 
 class Unparser:
     """Unparser to generate code from AST"""
     
+    _IDENT_LIKE = frozenset({TokenType.IDENTIFIER, TokenType.KEYWORD, TokenType.NUMBER})
+    _CLOSE_BRACKETS = frozenset({')', ']', '}'})
+    
+    # Number of tokens joined into each chunk yielded by unparse_iter
+    CHUNK_TOKENS = 4096
+    
     def __init__(self, lua_version='LuaU', pretty_print=False):
         self.lua_version = lua_version
         self.pretty_print = pretty_print
+        # For each (type, is closing bracket) of a token, the token types
+        # that need a space in front of them when they follow it
+        self._space_table = {
+            (prev_type, closing): frozenset(
+                curr_type for curr_type in TokenType
+                if self._needs_space(prev_type, ')' if closing else '', curr_type)
+            )
+            for prev_type in TokenType
+            for closing in (False, True)
+        }
     
     def unparse(self, ast):
         """Generate Lua/LuaU code from AST"""
+        code = ''.join(self._iter_chunks(ast))
+        if self.pretty_print:
+            code = self._pretty_print(code)
+        return code
+    
+    def unparse_iter(self, ast):
+        """Generate Lua/LuaU code from AST as a sequence of string chunks"""
+        if self.pretty_print:
+            # The pretty printer needs to see the whole program
+            yield self.unparse(ast)
+            return
+        yield from self._iter_chunks(ast)
+    
+    def _iter_chunks(self, ast):
+        """Yield the unformatted code in chunks of CHUNK_TOKENS tokens"""
         parts = []
-        previous = None
+        append = parts.append
+        format_token = self._format_token
+        space_table = self._space_table
+        close_brackets = self._CLOSE_BRACKETS
+        eof_type = TokenType.EOF
+        string_type = TokenType.STRING
+        chunk_tokens = self.CHUNK_TOKENS
+        space_before = frozenset()
+        count = 0
         
         for token in ast.tokens:
-            if token.type == TokenType.EOF:
+            token_type = token.type
+            if token_type is eof_type:
                 continue
             
-            text = self._format_token(token)
-            if previous is not None and self._needs_space(previous, token):
-                parts.append(' ')
-            parts.append(text)
-            previous = token
+            if token_type in space_before:
+                append(' ')
+            value = token.value
+            append(format_token(token) if token_type is string_type else value)
+            space_before = space_table[token_type, value in close_brackets]
+            count += 1
+            if count == chunk_tokens:
+                yield ''.join(parts)
+                parts = []
+                append = parts.append
+                count = 0
         
-        code = ''.join(parts)
-        if self.pretty_print:
-            code = self._pretty_print(code)
-        return code
+        if parts:
+            yield ''.join(parts)
     
     def _format_token(self, token):
         """Format token into text"""
         if token.type == TokenType.STRING:
-            escaped = token.value.replace('\\', '\\\\').replace('"', '\\"')
-            return f'"{escaped}"'
+            return '"' + escape_string(token.value) + '"'
         return token.value
     
-    def _needs_space(self, prev, curr):
+    def _needs_space(self, prev_type, prev_value, curr_type):
         """Determine if a space is required between two tokens"""
-        identifier_like = {TokenType.IDENTIFIER, TokenType.KEYWORD, TokenType.NUMBER}
-        if prev.type in identifier_like and curr.type in identifier_like:
-            return True
-        if prev.type in identifier_like and curr.value == '(' and curr.type == TokenType.SYMBOL:
-            return False
-        if prev.type == TokenType.STRING and curr.type in identifier_like:
-            return True
-        if curr.type == TokenType.STRING and prev.type in identifier_like:
-            return True
-        if prev.value in (')', ']', '}') and curr.type in identifier_like:
-            return True
-        if prev.type in identifier_like and curr.value in ('(', '['):
-            return False
-        if prev.value in ('.', ':', '::'):
-            return False
-        if curr.value in ('.', ':', '::'):
-            return False
-        if prev.value in ('..', '...') or curr.value in ('..', '...'):
-            return False
+        identifier_like = self._IDENT_LIKE
+        if curr_type in identifier_like:
+            return (prev_type in identifier_like or prev_type is TokenType.STRING
+                    or prev_value in self._CLOSE_BRACKETS)
+        if curr_type is TokenType.STRING:
+            return prev_type in identifier_like
         return False
     
     def _pretty_print(self, code):
         """Simple pretty printer that indents control structures"""
         indent = 0
         formatted = []
-        tokens = []
-        current = ''
-        for ch in code:
-            if ch in '(){}[];,' or ch.isspace():
-                if current:
-                    tokens.append(current)
-                    current = ''
-                if ch.strip():
-                    tokens.append(ch)
-            else:
-                current += ch
-        if current:
-            tokens.append(current)
+        append = formatted.append
         
-        i = 0
-        while i < len(tokens):
-            tok = tokens[i]
+        for tok in _PRETTY_TOKEN.findall(code):
+            if tok in ('end', '}', 'until'):
+                indent = max(0, indent - 1)
+            prefix = _INDENTS[indent] if indent < len(_INDENTS) else '    ' * indent
             if tok in ('then', 'do', '{'):
-                formatted.append('    ' * indent + tok)
-                formatted.append('\n')
+                append(prefix + tok)
+                append('\n')
                 indent += 1
             elif tok == 'function':
-                formatted.append('    ' * indent + tok + ' ')
-            elif tok in ('end', '}', 'until'):
-                indent = max(0, indent - 1)
-                formatted.append('    ' * indent + tok)
-                formatted.append('\n')
+                append(prefix + tok + ' ')
             else:
-                formatted.append('    ' * indent + tok)
-                formatted.append('\n')
-            i += 1
+                append(prefix + tok)
+                append('\n')
         
         return ''.join(formatted)
@@ -1,10 +1,12 @@
 """Tests for the Python Prometheus pipeline"""
 
+import io
 import unittest
 
 from src.pipeline import Pipeline
 from src.config import Presets
 from src.logger import Logger, LogLevel
+from src.prometheus.tokenizer import Tokenizer
 
 
 def build_logger():
@@ -17,19 +19,63 @@ def build_logger():
 class PipelineTests(unittest.TestCase):
     """Unit tests for the pipeline"""
 
-    def test_minify_preset_renames_locals(self):
+    def test_rename_variables_renames_locals(self):
         code = """local function greet(name)
         local message = "Hello, " .. name
         print(message)
 end
 """
         config = Presets.get('Minify').copy()
+        config['RenameVariables'] = True
         pipeline = Pipeline.from_config(config, build_logger())
         result = pipeline.apply(code, filename='test.lua')
         self.assertNotIn('message', result)
         self.assertNotIn('greet', result)
         self.assertIn('print', result)
 
+    def test_stepless_renaming_includes_prom_prefixed_locals(self):
+        code = 'local __PROM_x = 1 print(__PROM_x)'
+        for lua_version in ('LuaU', 'Lua51'):
+            config = Presets.get_mutable('Minify')
+            config['RenameVariables'] = True
+            config['LuaVersion'] = lua_version
+            result = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+            self.assertNotIn('__PROM_x', result)
+
+            # With steps, `__PROM_` names belong to the injected helpers
+            config['Steps'] = [{'Name': 'AntiTamper', 'Settings': {}}]
+            result = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+            self.assertIn('local __PROM_x=1', result)
+
+    def test_lua51_renaming_treats_luau_keywords_as_names(self):
+        code = 'local type = 1 local value = type print(value)'
+        for steps in ([], [{'Name': 'AntiTamper', 'Settings': {}}]):
+            config = Presets.get_mutable('Minify')
+            config['RenameVariables'] = True
+            config['LuaVersion'] = 'Lua51'
+            config['Steps'] = steps
+            result = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+            self.assertNotIn('type', result)
+            self.assertNotIn('value', result)
+            self.assertIn('print', result)
+
+    def test_shared_tokens_are_not_mutated(self):
+        code = 'local a, b = 1, "x" .. "x" print(a + b, (a))'
+        config = Presets.get_mutable('Strong')
+        config['RenameVariables'] = True
+        config['Steps'] = config['Steps'] + [{'Name': 'NumbersToExpressions', 'Settings': {}}]
+        Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+        for value, token in Tokenizer.SHARED_TOKENS.items():
+            self.assertEqual(token.value, value)
+            self.assertEqual((token.line, token.column), (0, 0))
+
+    def test_minify_preset_keeps_names(self):
+        code = 'local message = "Hello"\nprint(message)\n'
+        config = Presets.get('Minify').copy()
+        pipeline = Pipeline.from_config(config, build_logger())
+        result = pipeline.apply(code, filename='test.lua')
+        self.assertEqual(result, 'local message="Hello" print(message)')
+
     def test_encrypt_strings_inserts_helper(self):
         code = 'return "Hello"'
         config = Presets.get('Minify').copy()
@@ -39,6 +85,25 @@ end
         self.assertIn('__PROM_STR', result)
         self.assertNotIn('"Hello"', result)
 
+    def test_encrypt_strings_helper_survives_renaming(self):
+        code = 'local greeting = "Hello" print(greeting)'
+        config = Presets.get_mutable('Minify')
+        config['Steps'] = [{'Name': 'EncryptStrings', 'Settings': {}}]
+        config['RenameVariables'] = True
+        renamed = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+        config['RenameVariables'] = False
+        kept = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+        self.assertNotIn('bytes', renamed)
+        self.assertIn('bytes', kept)
+
+    def test_wrap_in_function_keeps_tokens_intact(self):
+        code = 'print("a\\nb", \'x"y\')'
+        config = Presets.get_mutable('Minify')
+        plain = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+        config['Steps'] = [{'Name': 'WrapInFunction', 'Settings': {}}]
+        wrapped = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+        self.assertEqual(wrapped, 'return(function() ' + plain + ' end)()')
+
     def test_vmify_step_generates_data_table(self):
         code = "print('ok')"
         config = Presets.get('Minify').copy()
@@ -48,6 +113,27 @@ end
         self.assertIn('__PROM_DATA', result)
         self.assertNotIn('print', result)
 
+    def test_apply_streams_output_to_file(self):
+        code = """local function greet(name)
+        local message = "Hello, " .. name
+        print(message)
+end
+"""
+        config = Presets.get('Minify').copy()
+        config['Seed'] = 1
+        expected = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua')
+        out = io.StringIO()
+        result = Pipeline.from_config(config, build_logger()).apply(code, filename='test.lua', out=out)
+        self.assertIsNone(result)
+        self.assertEqual(out.getvalue(), expected)
+
+    def test_presets_are_read_only_and_get_mutable_copies(self):
+        with self.assertRaises(TypeError):
+            Presets.get('Weak')['Seed'] = 1
+        config = Presets.get_mutable('Weak')
+        config['Steps'][1]['Settings']['Threshold'] = 5
+        self.assertEqual(Presets.get('Weak')['Steps'][1]['Settings']['Threshold'], 1)
+
 
 if __name__ == '__main__':
     unittest.main()
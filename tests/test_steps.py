@@ -0,0 +1,21 @@
+"""Tests for the obfuscation step helpers"""
+
+import unittest
+
+from src.prometheus.steps import NUMPY_MIN_LENGTH, _encode_string, _load_numpy
+
+
+class EncodeStringTests(unittest.TestCase):
+    """Unit tests for string encoding"""
+
+    @unittest.skipUnless(_load_numpy(), 'numpy is not installed')
+    def test_numpy_encoding_matches_plain_formula(self):
+        value = 'é€😀a' * 30
+        self.assertGreaterEqual(len(value), NUMPY_MIN_LENGTH)
+        key = 173
+        expected = [(ord(char) + key + idx) % 256 for idx, char in enumerate(value, start=1)]
+        self.assertEqual(_encode_string(value, key), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
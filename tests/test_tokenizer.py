@@ -0,0 +1,126 @@
+"""Tests for the Lua/LuaU tokenizer"""
+
+import unittest
+
+from src.prometheus.tokenizer import Tokenizer
+
+
+def tokenize(source, lua_version='LuaU'):
+    return [
+        (token.type.name, token.value, token.line, token.column)
+        for token in Tokenizer(lua_version).tokenize(source)
+    ]
+
+
+class TokenizerTests(unittest.TestCase):
+    """Unit tests for the tokenizer"""
+
+    def test_multiline_long_string_position(self):
+        self.assertEqual(tokenize('x = [[a\nbc]] y'), [
+            ('IDENTIFIER', 'x', 1, 1),
+            ('OPERATOR', '=', 1, 3),
+            ('STRING', 'a\nbc', 1, 5),
+            ('IDENTIFIER', 'y', 2, 4),
+            ('EOF', '', 2, 5),
+        ])
+
+    def test_multiline_long_comment_position(self):
+        self.assertEqual(tokenize('--[==[ one\ntwo ]==] y'), [
+            ('IDENTIFIER', 'y', 2, 6),
+            ('EOF', '', 2, 7),
+        ])
+
+    def test_unclosed_long_brackets(self):
+        self.assertEqual(tokenize('a [[ b'), [
+            ('IDENTIFIER', 'a', 1, 1),
+            ('SYMBOL', '[', 1, 3),
+            ('SYMBOL', '[', 1, 4),
+            ('IDENTIFIER', 'b', 1, 6),
+            ('EOF', '', 1, 7),
+        ])
+        self.assertEqual(tokenize('a [=[ b ]] c'), [
+            ('IDENTIFIER', 'a', 1, 1),
+            ('SYMBOL', '[', 1, 3),
+            ('OPERATOR', '=', 1, 4),
+            ('SYMBOL', '[', 1, 5),
+            ('IDENTIFIER', 'b', 1, 7),
+            ('SYMBOL', ']', 1, 9),
+            ('SYMBOL', ']', 1, 10),
+            ('IDENTIFIER', 'c', 1, 12),
+            ('EOF', '', 1, 13),
+        ])
+        # An unclosed long comment is a line comment
+        self.assertEqual(tokenize('--[[ open\ny'), [
+            ('IDENTIFIER', 'y', 2, 1),
+            ('EOF', '', 2, 2),
+        ])
+
+    def test_escaped_quotes(self):
+        self.assertEqual(tokenize('s = "a\\"b" t'), [
+            ('IDENTIFIER', 's', 1, 1),
+            ('OPERATOR', '=', 1, 3),
+            ('STRING', 'a\\"b', 1, 5),
+            ('IDENTIFIER', 't', 1, 12),
+            ('EOF', '', 1, 13),
+        ])
+        self.assertEqual(tokenize("'it\\'s'"), [
+            ('STRING', "it\\'s", 1, 1),
+            ('EOF', '', 1, 8),
+        ])
+        # Escapes on the last line of a multi-line string take no column
+        self.assertEqual(tokenize('"a\nb\\"c" d'), [
+            ('STRING', 'a\nb\\"c', 1, 1),
+            ('IDENTIFIER', 'd', 2, 5),
+            ('EOF', '', 2, 6),
+        ])
+
+    def test_unterminated_strings(self):
+        self.assertEqual(tokenize('"abc'), [('STRING', 'abc', 1, 1), ('EOF', '', 1, 6)])
+        self.assertEqual(tokenize('"ab\\'), [('STRING', 'ab\\', 1, 1), ('EOF', '', 1, 6)])
+
+    def test_dots(self):
+        self.assertEqual(tokenize('.5 .. ... ..< .'), [
+            ('NUMBER', '.5', 1, 1),
+            ('OPERATOR', '..', 1, 4),
+            ('OPERATOR', '...', 1, 7),
+            ('OPERATOR', '..<', 1, 11),
+            ('SYMBOL', '.', 1, 15),
+            ('EOF', '', 1, 16),
+        ])
+
+    def test_numbers(self):
+        self.assertEqual(tokenize('0xFF 0X1f 0x 1e+5 3.14'), [
+            ('NUMBER', '0xFF', 1, 1),
+            ('NUMBER', '0X1f', 1, 6),
+            ('NUMBER', '0x', 1, 11),
+            ('NUMBER', '1e+5', 1, 14),
+            ('NUMBER', '3.14', 1, 19),
+            ('EOF', '', 1, 23),
+        ])
+
+    def test_non_ascii_identifiers_and_digits(self):
+        self.assertEqual(tokenize('é²x ²3 x²'), [
+            ('IDENTIFIER', 'é²x', 1, 1),
+            ('NUMBER', '²3', 1, 5),
+            ('IDENTIFIER', 'x²', 1, 8),
+            ('EOF', '', 1, 10),
+        ])
+
+    def test_luau_keywords_depend_on_version(self):
+        source = 'type continue export local'
+        self.assertEqual([kind for kind, _, _, _ in tokenize(source, 'LuaU')],
+                         ['KEYWORD', 'KEYWORD', 'KEYWORD', 'KEYWORD', 'EOF'])
+        self.assertEqual([kind for kind, _, _, _ in tokenize(source, 'Lua51')],
+                         ['IDENTIFIER', 'IDENTIFIER', 'IDENTIFIER', 'KEYWORD', 'EOF'])
+
+    def test_eof_position(self):
+        self.assertEqual(tokenize(''), [('EOF', '', 1, 1)])
+        self.assertEqual(tokenize('a\n  bc  '), [
+            ('IDENTIFIER', 'a', 1, 1),
+            ('IDENTIFIER', 'bc', 2, 3),
+            ('EOF', '', 2, 7),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()